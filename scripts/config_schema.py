@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+JSON Schema for config/supabase_config.json
+Describes the sections and compliance settings the database setup relies on.
+"""
+
+from typing import Any, Dict
+
+try:
+    import fastjsonschema
+except ImportError:  # Compiled validation is optional
+    fastjsonschema = None
+
+
+# Top-level sections every supabase_config.json must define
+REQUIRED_SECTIONS = frozenset({
+    "database", "connection", "tables", "storage",
+    "security", "performance", "monitoring", "compliance"
+})
+
+EXPECTED_STANDARDS = frozenset({"IEC 62304 Class C", "HIPAA", "GDPR"})
+
+_ENABLED = {"const": True}
+
+CONFIG_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "required": sorted(REQUIRED_SECTIONS),
+    "properties": {
+        "database": {
+            "type": "object",
+            "required": ["name", "version", "compliance_standards"],
+            "properties": {
+                "name": {"type": "string"},
+                "version": {"type": "string"},
+                "compliance_standards": {
+                    "type": "array",
+                    "allOf": [{"contains": {"const": standard}} for standard in sorted(EXPECTED_STANDARDS)]
+                }
+            }
+        },
+        "connection": {
+            "type": "object",
+            "required": ["timeout"],
+            "properties": {
+                "timeout": {"type": "integer"},
+                "retry_attempts": {"type": "integer"}
+            }
+        },
+        "tables": {"type": "object"},
+        "storage": {
+            "type": "object",
+            "required": ["buckets"],
+            "properties": {
+                "buckets": {"type": "object"}
+            }
+        },
+        "security": {"type": "object"},
+        "performance": {"type": "object"},
+        "monitoring": {"type": "object"},
+        "compliance": {
+            "type": "object",
+            "required": ["hipaa", "iec62304", "gdpr"],
+            "properties": {
+                "hipaa": {
+                    "type": "object",
+                    "required": ["enabled", "encryption_at_rest", "encryption_in_transit", "access_logging"],
+                    "properties": {
+                        "enabled": _ENABLED,
+                        "encryption_at_rest": _ENABLED,
+                        "encryption_in_transit": _ENABLED,
+                        "access_logging": _ENABLED
+                    }
+                },
+                "iec62304": {
+                    "type": "object",
+                    "required": ["enabled", "class", "risk_management", "verification"],
+                    "properties": {
+                        "enabled": _ENABLED,
+                        "class": {"const": "C"},
+                        "risk_management": _ENABLED,
+                        "verification": _ENABLED
+                    }
+                },
+                "gdpr": {
+                    "type": "object",
+                    "required": ["enabled", "right_to_be_forgotten", "consent_management"],
+                    "properties": {
+                        "enabled": _ENABLED,
+                        "right_to_be_forgotten": _ENABLED,
+                        "consent_management": _ENABLED
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+def _validate_fallback(data: Any) -> Any:
+    """Plain checks of the sections and compliance settings when fastjsonschema is not installed"""
+    missing_sections = REQUIRED_SECTIONS - data.keys()
+    if missing_sections:
+        raise ValueError(f"Missing required configuration sections: {sorted(missing_sections)}")
+    
+    missing_standards = EXPECTED_STANDARDS.difference(data["database"].get("compliance_standards", ()))
+    if missing_standards:
+        raise ValueError(f"Missing compliance standards: {sorted(missing_standards)}")
+    
+    compliance = data["compliance"]
+    compliance_schema = CONFIG_SCHEMA["properties"]["compliance"]["properties"]
+    disabled_features = [
+        f"{standard}.{feature}"
+        for standard, standard_schema in compliance_schema.items()
+        for feature, feature_schema in standard_schema["properties"].items()
+        if feature_schema is _ENABLED and compliance.get(standard, {}).get(feature) is not True
+    ]
+    if disabled_features:
+        raise ValueError(f"Compliance features not enabled: {disabled_features}")
+    
+    iec_class = compliance.get("iec62304", {}).get("class")
+    if iec_class != "C":
+        raise ValueError(f"Expected IEC 62304 Class C, got: {iec_class}")
+    
+    return data
+
+
+# Compiled once at import and reused for every validation; both variants
+# return the data and raise a ValueError (or subclass) on a bad config
+if fastjsonschema is not None:
+    validate_config = fastjsonschema.compile(CONFIG_SCHEMA)
+else:
+    validate_config = _validate_fallback
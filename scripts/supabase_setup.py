@@ -9,13 +9,762 @@ including tables, indexes, RLS policies, and storage buckets.
 
 import os
 import json
+import hashlib
+import functools
+import gzip
+import re
+import shutil
+import subprocess
 import logging
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from typing import Dict, List, Any
+from types import MappingProxyType
+from urllib.parse import unquote, urlsplit, urlunsplit
+from typing import Dict, Iterable, List, Any, Optional, Sequence, Set, Tuple
 from datetime import datetime
 
+try:
+    import psycopg
+    from psycopg import sql as pg_sql
+except ImportError:  # Direct database access is optional
+    psycopg = None
+    pg_sql = None
+
+try:
+    import orjson
+except ImportError:  # Faster JSON serialization is optional
+    orjson = None
+
+
+def _dump_json(data: Any) -> bytes:
+    """Serialize data as indented JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2).encode()
+
+
+# Generated documentation lives in the repository, wherever the script runs from
+_DOCS_DIR = Path(__file__).resolve().parent.parent / "docs" / "database"
+
+
+# Schema definitions are built once at import time and shared by every
+# SupabaseSetup instance
+
+_TABLES = (
+    {
+        'name': 'patients',
+        'sql': '''
+        CREATE TABLE IF NOT EXISTS patients (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            patient_identifier TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            date_of_birth DATE NOT NULL,
+            gender TEXT NOT NULL CHECK (gender IN ('male', 'female', 'other')),
+            contact_info JSONB,
+            medical_history JSONB,
+            emergency_contact JSONB,
+            consent_status BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            created_by UUID,
+            updated_by UUID
+        );
+        
+        COMMENT ON TABLE patients IS 'Patient information - HIPAA compliant';
+        COMMENT ON COLUMN patients.patient_identifier IS 'Anonymous patient identifier';
+        COMMENT ON COLUMN patients.consent_status IS 'Patient consent for data processing';
+        '''
+    },
+    {
+        'name': 'treatment_sessions',
+        'sql': '''
+        CREATE TABLE IF NOT EXISTS treatment_sessions (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            patient_id UUID REFERENCES patients(id) ON DELETE CASCADE,
+            session_date TIMESTAMP WITH TIME ZONE NOT NULL,
+            duration INTEGER NOT NULL CHECK (duration > 0),
+            session_type TEXT NOT NULL,
+            exercises JSONB NOT NULL,
+            performance_metrics JSONB,
+            therapist_notes TEXT,
+            device_id TEXT NOT NULL,
+            session_status TEXT DEFAULT 'completed' CHECK (session_status IN ('in_progress', 'completed', 'cancelled')),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            created_by UUID,
+            updated_by UUID
+        );
+        
+        COMMENT ON TABLE treatment_sessions IS 'Physical therapy treatment sessions';
+        COMMENT ON COLUMN treatment_sessions.duration IS 'Session duration in minutes';
+        COMMENT ON COLUMN treatment_sessions.device_id IS 'Device used for the session';
+        '''
+    },
+    {
+        'name': 'exercise_data',
+        'sql': '''
+        CREATE TABLE IF NOT EXISTS exercise_data (
+            id UUID DEFAULT gen_random_uuid(),
+            session_id UUID REFERENCES treatment_sessions(id) ON DELETE CASCADE,
+            exercise_type TEXT NOT NULL,
+            exercise_name TEXT NOT NULL,
+            repetitions INTEGER NOT NULL CHECK (repetitions >= 0),
+            accuracy_score FLOAT NOT NULL CHECK (accuracy_score >= 0 AND accuracy_score <= 100),
+            form_analysis JSONB,
+            movement_data JSONB,
+            ai_feedback JSONB,
+            completion_time INTEGER,
+            difficulty_level INTEGER CHECK (difficulty_level BETWEEN 1 AND 10),
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+        
+        CREATE TABLE IF NOT EXISTS exercise_data_default PARTITION OF exercise_data DEFAULT;
+        
+        COMMENT ON TABLE exercise_data IS 'Individual exercise performance data';
+        COMMENT ON COLUMN exercise_data.accuracy_score IS 'Exercise accuracy percentage (0-100)';
+        COMMENT ON COLUMN exercise_data.completion_time IS 'Time to complete exercise in seconds';
+        '''
+    },
+    {
+        'name': 'device_logs',
+        'sql': '''
+        CREATE TABLE IF NOT EXISTS device_logs (
+            id UUID DEFAULT gen_random_uuid(),
+            device_id TEXT NOT NULL,
+            log_type TEXT NOT NULL CHECK (log_type IN ('info', 'warning', 'error', 'critical')),
+            message TEXT NOT NULL,
+            severity TEXT NOT NULL CHECK (severity IN ('low', 'medium', 'high', 'critical')),
+            component TEXT,
+            error_code TEXT,
+            metadata JSONB,
+            session_id UUID REFERENCES treatment_sessions(id),
+            timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+        
+        CREATE TABLE IF NOT EXISTS device_logs_default PARTITION OF device_logs DEFAULT;
+        
+        COMMENT ON TABLE device_logs IS 'Device operation and error logs';
+        COMMENT ON COLUMN device_logs.component IS 'System component that generated the log';
+        COMMENT ON COLUMN device_logs.error_code IS 'IEC 62304 compliant error code';
+        '''
+    },
+    {
+        'name': 'performance_metrics',
+        'sql': '''
+        CREATE TABLE IF NOT EXISTS performance_metrics (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            session_id UUID REFERENCES treatment_sessions(id) ON DELETE CASCADE,
+            metric_type TEXT NOT NULL,
+            metric_name TEXT NOT NULL,
+            value FLOAT NOT NULL,
+            unit TEXT NOT NULL,
+            target_value FLOAT,
+            improvement_percentage FLOAT,
+            measurement_timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+        
+        COMMENT ON TABLE performance_metrics IS 'Patient performance metrics and progress tracking';
+        COMMENT ON COLUMN performance_metrics.target_value IS 'Target value for this metric';
+        COMMENT ON COLUMN performance_metrics.improvement_percentage IS 'Improvement from baseline';
+        '''
+    },
+    {
+        'name': 'ai_models',
+        'sql': '''
+        CREATE TABLE IF NOT EXISTS ai_models (
+            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+            model_name TEXT UNIQUE NOT NULL,
+            model_version TEXT NOT NULL,
+            model_type TEXT NOT NULL CHECK (model_type IN ('pose_estimation', 'movement_analysis', 'quality_assessment')),
+            accuracy_score FLOAT CHECK (accuracy_score >= 0 AND accuracy_score <= 100),
+            training_data_info JSONB,
+            model_parameters JSONB,
+            validation_results JSONB,
+            deployment_status TEXT DEFAULT 'development' CHECK (deployment_status IN ('development', 'testing', 'production')),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            created_by UUID
+        );
+        
+        COMMENT ON TABLE ai_models IS 'AI model versions and metadata';
+        COMMENT ON COLUMN ai_models.accuracy_score IS 'Model accuracy percentage';
+        '''
+    }
+)
+
+# device_logs and exercise_data are range-partitioned by month so time
+# window queries only touch recent partitions; pg_cron keeps one month
+# of partitions created ahead of time
+_PARTITION_MAINTENANCE_SQL = '''
+CREATE OR REPLACE FUNCTION create_monthly_partition(parent_table TEXT, month_start DATE)
+RETURNS VOID AS $$
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+        parent_table || '_' || to_char(month_start, 'YYYY_MM'),
+        parent_table,
+        month_start,
+        (month_start + INTERVAL '1 month')::DATE
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_monthly_partition(parent_table, (date_trunc('month', NOW()) + month_offset)::DATE)
+FROM unnest(ARRAY['device_logs', 'exercise_data']) AS parent_table,
+     unnest(ARRAY[INTERVAL '0 months', INTERVAL '1 month']) AS month_offset;
+
+CREATE EXTENSION IF NOT EXISTS pg_cron;
+SELECT cron.schedule(
+    'create-monthly-partitions',
+    '0 0 1 * *',
+    $$SELECT create_monthly_partition(parent_table, (date_trunc('month', NOW()) + INTERVAL '1 month')::DATE)
+      FROM unnest(ARRAY['device_logs', 'exercise_data']) AS parent_table$$
+);
+'''
+
+# Large repeated-key JSONB payloads decompress ~2-3x faster with LZ4
+# than the default PGLZ (requires PostgreSQL 14+). Partitions created
+# later inherit the setting from their parent.
+_COMPRESSION_SQL = '''
+ALTER TABLE exercise_data ALTER COLUMN form_analysis SET COMPRESSION lz4;
+ALTER TABLE exercise_data ALTER COLUMN movement_data SET COMPRESSION lz4;
+ALTER TABLE device_logs ALTER COLUMN metadata SET COMPRESSION lz4;
+ALTER TABLE ai_models ALTER COLUMN model_parameters SET COMPRESSION lz4;
+'''
+
+_CREATE_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS idx_patients_identifier ON patients(patient_identifier);",
+    # Low-selectivity indexes that cost more on writes than they save on reads
+    "DROP INDEX IF EXISTS idx_patients_name;",
+    "DROP INDEX IF EXISTS idx_device_logs_severity;",
+    # GIN only on JSONB columns that are filtered by containment; write-only
+    # payloads such as exercise_data.ai_feedback stay unindexed
+    "CREATE INDEX IF NOT EXISTS idx_patients_contact_gin ON patients USING GIN (contact_info jsonb_path_ops);",
+    # Covering indexes let get_patient_progress run as index-only scans; they
+    # lead on the same columns as the plain indexes they replace
+    "DROP INDEX IF EXISTS idx_treatment_sessions_patient_id;",
+    "DROP INDEX IF EXISTS idx_exercise_data_session_id;",
+    "CREATE INDEX IF NOT EXISTS idx_treatment_sessions_patient_date ON treatment_sessions(patient_id, session_date DESC) INCLUDE (duration);",
+    "CREATE INDEX IF NOT EXISTS idx_treatment_sessions_date ON treatment_sessions(session_date);",
+    "CREATE INDEX IF NOT EXISTS idx_treatment_sessions_device ON treatment_sessions(device_id);",
+    "CREATE INDEX IF NOT EXISTS idx_exercise_data_session_cover ON exercise_data(session_id) INCLUDE (accuracy_score);",
+    "CREATE INDEX IF NOT EXISTS idx_exercise_data_type ON exercise_data(exercise_type);",
+    # Append-only timestamps are physically correlated with insert order,
+    # so a BRIN summary per page range is enough for range scans; the B-tree
+    # versions they replace are dropped
+    "DROP INDEX IF EXISTS idx_exercise_data_timestamp;",
+    "DROP INDEX IF EXISTS idx_device_logs_timestamp;",
+    "CREATE INDEX IF NOT EXISTS idx_exercise_data_timestamp_brin ON exercise_data USING BRIN(timestamp) WITH (pages_per_range = 32);",
+    # Serves get_device_health (device_id = ? AND timestamp >= ?); severity
+    # is filtered in-query rather than through its own low-selectivity index
+    "DROP INDEX IF EXISTS idx_device_logs_device_id;",
+    "CREATE INDEX IF NOT EXISTS idx_device_logs_device_ts ON device_logs(device_id, timestamp DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_device_logs_timestamp_brin ON device_logs USING BRIN(timestamp) WITH (pages_per_range = 32);",
+    "CREATE INDEX IF NOT EXISTS idx_device_logs_meta_gin ON device_logs USING GIN (metadata jsonb_path_ops);",
+    "CREATE INDEX IF NOT EXISTS idx_performance_metrics_session_id ON performance_metrics(session_id);",
+    "CREATE INDEX IF NOT EXISTS idx_performance_metrics_type ON performance_metrics(metric_type);",
+    "CREATE INDEX IF NOT EXISTS idx_ai_models_name_version ON ai_models(model_name, model_version);"
+)
+
+# Enable RLS on all tables
+_RLS_TABLES = (
+    'patients', 'treatment_sessions', 'exercise_data', 
+    'device_logs', 'performance_metrics', 'ai_models'
+)
+
+_RLS_POLICIES = (
+    {
+        'table': 'patients',
+        'name': 'patients_view_own_data',
+        'sql': '''
+        DROP POLICY IF EXISTS "Patients can view own data" ON patients;
+        CREATE POLICY "Patients can view own data" ON patients
+        FOR SELECT USING (auth.uid() = id OR auth.role() IN ('therapist', 'admin'));
+        '''
+    },
+    {
+        'table': 'patients',
+        'name': 'therapists_can_manage_patients',
+        'sql': '''
+        DROP POLICY IF EXISTS "Therapists can manage patient data" ON patients;
+        CREATE POLICY "Therapists can manage patient data" ON patients
+        FOR ALL USING (auth.role() IN ('therapist', 'admin'));
+        '''
+    },
+    {
+        'table': 'treatment_sessions',
+        'name': 'sessions_access_control',
+        'sql': '''
+        DROP POLICY IF EXISTS "Session access control" ON treatment_sessions;
+        CREATE POLICY "Session access control" ON treatment_sessions
+        FOR ALL USING (
+            auth.role() IN ('therapist', 'admin') OR 
+            patient_id IN (SELECT id FROM patients WHERE auth.uid() = id)
+        );
+        '''
+    },
+    {
+        'table': 'exercise_data',
+        'name': 'exercise_data_access_control',
+        'sql': '''
+        DROP POLICY IF EXISTS "Exercise data access control" ON exercise_data;
+        CREATE POLICY "Exercise data access control" ON exercise_data
+        FOR SELECT USING (
+            auth.role() IN ('therapist', 'admin') OR 
+            session_id IN (SELECT id FROM treatment_sessions WHERE patient_id = auth.uid())
+        );
+        '''
+    },
+    {
+        'table': 'performance_metrics',
+        'name': 'performance_metrics_access_control',
+        'sql': '''
+        DROP POLICY IF EXISTS "Performance metrics access control" ON performance_metrics;
+        CREATE POLICY "Performance metrics access control" ON performance_metrics
+        FOR SELECT USING (
+            auth.role() IN ('therapist', 'admin') OR 
+            session_id IN (SELECT id FROM treatment_sessions WHERE patient_id = auth.uid())
+        );
+        '''
+    },
+    {
+        'table': 'device_logs',
+        'name': 'system_can_manage_logs',
+        'sql': '''
+        DROP POLICY IF EXISTS "System can manage device logs" ON device_logs;
+        CREATE POLICY "System can manage device logs" ON device_logs
+        FOR ALL USING (auth.role() IN ('service_role', 'admin', 'system'));
+        '''
+    },
+    {
+        'table': 'ai_models',
+        'name': 'ai_models_access_control',
+        'sql': '''
+        DROP POLICY IF EXISTS "AI models access control" ON ai_models;
+        CREATE POLICY "AI models access control" ON ai_models
+        FOR SELECT USING (deployment_status = 'production' OR auth.role() IN ('developer', 'admin'));
+        '''
+    }
+)
+
+# Hours of history kept in device_health_rollup. Only this slice of the
+# partitioned device_logs table is scanned on each refresh
+_ROLLUP_RETENTION_HOURS = 7 * 24
+
+_DEVICE_HEALTH_ROLLUP_SQL = f'''
+CREATE MATERIALIZED VIEW IF NOT EXISTS device_health_rollup AS
+SELECT 
+    device_id,
+    date_trunc('hour', timestamp) AS hour_bucket,
+    COUNT(*) AS log_count,
+    COUNT(*) FILTER (WHERE log_type = 'error') AS errors,
+    COUNT(*) FILTER (WHERE log_type = 'warning') AS warnings,
+    COUNT(*) FILTER (WHERE log_type = 'critical') AS criticals
+FROM device_logs
+WHERE timestamp >= date_trunc('hour', NOW()) - INTERVAL '{_ROLLUP_RETENTION_HOURS} hours'
+GROUP BY device_id, date_trunc('hour', timestamp);
+
+-- Unique index required for REFRESH ... CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_device_health_rollup_device_hour
+    ON device_health_rollup(device_id, hour_bucket);
+
+-- Materialized views cannot have RLS; keep the per-device counts,
+-- which the device_logs policy restricts, out of the public API
+REVOKE ALL ON device_health_rollup FROM anon, authenticated;
+
+SELECT cron.schedule(
+    'refresh-device-health-rollup',
+    '*/5 * * * *',
+    $$REFRESH MATERIALIZED VIEW CONCURRENTLY device_health_rollup$$
+);
+
+COMMENT ON MATERIALIZED VIEW device_health_rollup IS 'Hourly device log counts, refreshed every 5 minutes';
+'''
+
+# The reporting functions are plain LANGUAGE sql STABLE wrappers so the
+# planner can inline them into the calling query
+_FUNCTIONS = (
+    {
+        'name': 'calculate_session_metrics',
+        'sql': '''
+        CREATE OR REPLACE FUNCTION calculate_session_metrics(session_id UUID)
+        RETURNS TABLE(metric_type TEXT, metric_name TEXT, value FLOAT, unit TEXT) AS $$
+            SELECT 
+                pm.metric_type,
+                pm.metric_name,
+                pm.value,
+                pm.unit
+            FROM performance_metrics pm
+            WHERE pm.session_id = calculate_session_metrics.session_id
+            ORDER BY pm.created_at;
+        $$ LANGUAGE sql STABLE;
+        
+        COMMENT ON FUNCTION calculate_session_metrics IS 'Calculate performance metrics for a session';
+        '''
+    },
+    {
+        'name': 'get_patient_progress',
+        'sql': '''
+        CREATE OR REPLACE FUNCTION get_patient_progress(patient_id UUID, days_back INTEGER DEFAULT 30)
+        RETURNS TABLE(session_date DATE, average_accuracy FLOAT, total_exercises INTEGER, session_duration INTEGER) AS $$
+            SELECT 
+                ts.session_date::DATE,
+                ROUND(AVG(ed.accuracy_score)::numeric, 2)::FLOAT as average_accuracy,
+                COUNT(*)::INTEGER as total_exercises,
+                ts.duration
+            FROM treatment_sessions ts
+            JOIN exercise_data ed ON ts.id = ed.session_id
+            WHERE ts.patient_id = get_patient_progress.patient_id
+                AND ts.session_date >= (CURRENT_DATE - INTERVAL '1 day' * get_patient_progress.days_back)
+            GROUP BY ts.session_date::DATE, ts.duration
+            ORDER BY ts.session_date::DATE;
+        $$ LANGUAGE sql STABLE;
+        
+        COMMENT ON FUNCTION get_patient_progress IS 'Get patient progress over specified time period';
+        '''
+    },
+    {
+        'name': 'get_device_health',
+        'sql': f'''
+        CREATE OR REPLACE FUNCTION get_device_health(device_id TEXT, hours_back INTEGER DEFAULT 24)
+        RETURNS TABLE(
+            total_logs INTEGER,
+            error_count INTEGER,
+            warning_count INTEGER,
+            critical_count INTEGER,
+            health_score FLOAT
+        ) AS $$
+        DECLARE
+            total_logs_count INTEGER;
+            error_count_val INTEGER;
+            warning_count_val INTEGER;
+            critical_count_val INTEGER;
+            health_score_val FLOAT;
+            window_start TIMESTAMP WITH TIME ZONE := NOW() - INTERVAL '1 hour' * hours_back;
+            current_hour TIMESTAMP WITH TIME ZONE := date_trunc('hour', NOW());
+            first_full_hour TIMESTAMP WITH TIME ZONE := date_trunc('hour', window_start);
+        BEGIN
+            IF first_full_hour < window_start THEN
+                first_full_hour := first_full_hour + INTERVAL '1 hour';
+            END IF;
+            
+            -- The rollup starts {_ROLLUP_RETENTION_HOURS} hours before the hour of its last
+            -- refresh, which may be one hour boundary behind NOW(); windows
+            -- that could reach past that are counted live
+            IF hours_back >= {_ROLLUP_RETENTION_HOURS - 1} THEN
+                first_full_hour := current_hour;
+            END IF;
+            
+            -- Whole closed hours come from the hourly rollup; the partial
+            -- first hour and the current hour are counted live, so the
+            -- window starts exactly hours_back hours ago
+            SELECT 
+                COALESCE(SUM(buckets.log_count), 0),
+                COALESCE(SUM(buckets.errors), 0),
+                COALESCE(SUM(buckets.warnings), 0),
+                COALESCE(SUM(buckets.criticals), 0)
+            INTO total_logs_count, error_count_val, warning_count_val, critical_count_val
+            FROM (
+                SELECT r.log_count, r.errors, r.warnings, r.criticals
+                FROM device_health_rollup r
+                WHERE r.device_id = get_device_health.device_id
+                    AND r.hour_bucket >= first_full_hour
+                    AND r.hour_bucket < current_hour
+                UNION ALL
+                SELECT 
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE dl.log_type = 'error'),
+                    COUNT(*) FILTER (WHERE dl.log_type = 'warning'),
+                    COUNT(*) FILTER (WHERE dl.log_type = 'critical')
+                FROM device_logs dl
+                WHERE dl.device_id = get_device_health.device_id
+                    AND dl.timestamp >= window_start
+                    AND dl.timestamp < LEAST(first_full_hour, current_hour)
+                UNION ALL
+                SELECT 
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE dl.log_type = 'error'),
+                    COUNT(*) FILTER (WHERE dl.log_type = 'warning'),
+                    COUNT(*) FILTER (WHERE dl.log_type = 'critical')
+                FROM device_logs dl
+                WHERE dl.device_id = get_device_health.device_id
+                    AND dl.timestamp >= GREATEST(window_start, current_hour)
+            ) buckets;
+            
+            -- Calculate health score (0-100)
+            health_score_val := CASE 
+                WHEN total_logs_count = 0 THEN 100
+                ELSE GREATEST(0, 100 - (critical_count_val * 30) - (error_count_val * 10) - (warning_count_val * 2))
+            END;
+            
+            RETURN QUERY SELECT 
+                total_logs_count,
+                error_count_val,
+                warning_count_val,
+                critical_count_val,
+                health_score_val;
+        END;
+        $$ LANGUAGE plpgsql SECURITY DEFINER;
+        
+        COMMENT ON FUNCTION get_device_health IS 'Calculate device health score based on logs';
+        '''
+    }
+)
+
+# One generic trigger function maintains the audit columns on every table
+# that has them, instead of a copy per table
+_TOUCH_AUDIT_COLS_SQL = '''
+CREATE OR REPLACE FUNCTION touch_audit_cols()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    NEW.updated_by = auth.uid();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+'''
+
+_TRIGGERS = (
+    {
+        'name': 'update_patient_timestamp',
+        'table': 'patients',
+        'sql': '''
+        DROP TRIGGER IF EXISTS update_patient_timestamp ON patients;
+        CREATE TRIGGER update_patient_timestamp
+            BEFORE UPDATE ON patients
+            FOR EACH ROW EXECUTE FUNCTION touch_audit_cols();
+        '''
+    },
+    {
+        'name': 'update_session_timestamp',
+        'table': 'treatment_sessions',
+        'sql': '''
+        DROP TRIGGER IF EXISTS update_session_timestamp ON treatment_sessions;
+        CREATE TRIGGER update_session_timestamp
+            BEFORE UPDATE ON treatment_sessions
+            FOR EACH ROW EXECUTE FUNCTION touch_audit_cols();
+        '''
+    }
+)
+
+# Per-table trigger functions replaced by touch_audit_cols()
+_DROP_LEGACY_TRIGGER_FUNCTIONS_SQL = '''
+DROP FUNCTION IF EXISTS update_patient_timestamp();
+DROP FUNCTION IF EXISTS update_session_timestamp();
+'''
+
+_AUDIT_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS audit_trail (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    table_name TEXT NOT NULL,
+    record_id UUID NOT NULL,
+    action TEXT NOT NULL CHECK (action IN ('INSERT', 'UPDATE', 'DELETE')),
+    old_data JSONB,
+    new_data JSONB,
+    user_id UUID,
+    user_role TEXT,
+    ip_address INET,
+    user_agent TEXT,
+    timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+COMMENT ON TABLE audit_trail IS 'Audit trail for all database changes - IEC 62304 compliance';
+'''
+
+# Audit rows carry full row images, PHI included. Only admins may read
+# them, and the API roles get no direct access; audit_changes() writes as
+# the table owner, which RLS does not apply to
+_AUDIT_RLS_SQL = '''
+ALTER TABLE audit_trail ENABLE ROW LEVEL SECURITY;
+REVOKE ALL ON audit_trail FROM anon, authenticated;
+DROP POLICY IF EXISTS "Admins can read audit trail" ON audit_trail;
+CREATE POLICY "Admins can read audit trail" ON audit_trail
+FOR SELECT USING (auth.role() IN ('admin', 'service_role'));
+'''
+
+_AUDIT_INDEXES = (
+    # table_name is only ever compared for equality
+    "DROP INDEX IF EXISTS idx_audit_table_name;",
+    "CREATE INDEX IF NOT EXISTS idx_audit_table_name_hash ON audit_trail USING HASH(table_name);",
+    "CREATE INDEX IF NOT EXISTS idx_audit_record_id ON audit_trail(record_id);",
+    "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_trail(timestamp);",
+    "CREATE INDEX IF NOT EXISTS idx_audit_user_id ON audit_trail(user_id);",
+    "CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_trail(action);"
+)
+
+# Written for statement-level triggers reading transition tables, so a
+# multi-row statement writes its audit rows with one INSERT ... SELECT instead
+# of one INSERT per modified row. Setup does not attach it to any table:
+# which tables are audited, and for which events, is a compliance decision.
+# A trigger with transition tables handles one event, e.g. for updates:
+#   CREATE TRIGGER audit_<table>_update AFTER UPDATE ON <table>
+#       REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+#       FOR EACH STATEMENT EXECUTE FUNCTION audit_changes();
+_AUDIT_FUNCTION_SQL = '''
+CREATE OR REPLACE FUNCTION audit_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO audit_trail (table_name, record_id, action, new_data, user_id, user_role)
+        SELECT TG_TABLE_NAME, n.id, TG_OP, to_jsonb(n), auth.uid(), auth.role()
+        FROM new_rows n;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO audit_trail (table_name, record_id, action, old_data, new_data, user_id, user_role)
+        SELECT TG_TABLE_NAME, n.id, TG_OP, to_jsonb(o), to_jsonb(n), auth.uid(), auth.role()
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id;
+    ELSE
+        INSERT INTO audit_trail (table_name, record_id, action, old_data, user_id, user_role)
+        SELECT TG_TABLE_NAME, o.id, TG_OP, to_jsonb(o), auth.uid(), auth.role()
+        FROM old_rows o;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+'''
+
+_BUCKETS = (
+    {
+        'name': 'patient-data',
+        'public': False,
+        'description': 'HIPAA-compliant patient data storage'
+    },
+    {
+        'name': 'exercise-videos',
+        'public': False,
+        'description': 'Exercise demonstration videos'
+    },
+    {
+        'name': 'model-files',
+        'public': False,
+        'description': 'AI model files and weights'
+    },
+    {
+        'name': 'reports',
+        'public': False,
+        'description': 'Patient progress reports'
+    },
+    {
+        'name': 'device-logs',
+        'public': False,
+        'description': 'Device operation logs'
+    }
+)
+
+def _policy_predicate(policy_sql: str) -> Optional[str]:
+    """Return the text inside a policy's USING (...) clause, if it has one"""
+    # WITH CHECK-only policies (e.g. FOR INSERT) filter no reads
+    match = re.search(r'\bUSING\s*\(', policy_sql, re.IGNORECASE)
+    if match is None:
+        return None
+    start = match.end() - 1
+    depth = 0
+    for position in range(start, len(policy_sql)):
+        if policy_sql[position] == '(':
+            depth += 1
+        elif policy_sql[position] == ')':
+            depth -= 1
+            if depth == 0:
+                return policy_sql[start + 1:position]
+    raise ValueError(f"Unbalanced USING clause in policy: {policy_sql}")
+
+
+def _policy_columns(policy_sql: str, table_columns: Set[str]) -> List[str]:
+    """Columns of the policy's own table referenced by its USING clause"""
+    predicate = _policy_predicate(policy_sql)
+    if predicate is None:
+        return []
+    predicate = re.sub(r"'[^']*'", '', predicate)          # string literals
+    predicate = re.sub(r'\w+\.\w+\([^()]*\)', '', predicate)  # auth.uid(), auth.role()
+    predicate = re.sub(r'\(\s*SELECT[^()]*\)', '', predicate, flags=re.IGNORECASE)  # subqueries
+    referenced = re.findall(r'(?<![.\w])([a-z_][a-z0-9_]*)\b', predicate)
+    return sorted(set(referenced) & table_columns)
+
+
+def _rls_predicate_indexes(policies: Sequence[Dict[str, str]] = _RLS_POLICIES) -> Tuple[str, ...]:
+    """
+    Index statements for RLS predicate columns that no index covers yet
+    
+    A policy's USING clause is an implicit WHERE on every query against the
+    table; without an index leading on each referenced column it forces a
+    sequential scan. Columns a CHECK (... IN (...)) constraint limits to a
+    handful of values are left out, as an index on them would not be used.
+    """
+    table_columns: Dict[str, Set[str]] = {}
+    indexed_columns: Dict[str, Set[str]] = {}
+    
+    for table in _TABLES:
+        enumerated = set(re.findall(r'^\s*([a-z_][a-z0-9_]*) [A-Z].*\bCHECK \(\1 IN \(', table['sql'], re.MULTILINE))
+        table_columns[table['name']] = set(re.findall(r'^\s*([a-z_][a-z0-9_]*) [A-Z]', table['sql'], re.MULTILINE)) - enumerated
+        covered = indexed_columns.setdefault(table['name'], set())
+        covered.update(re.findall(r'^\s*([a-z_][a-z0-9_]*) [A-Z].*\b(?:PRIMARY KEY|UNIQUE)\b', table['sql'], re.MULTILINE))
+        covered.update(re.findall(r'PRIMARY KEY \((\w+)', table['sql']))
+    
+    for index_sql in _CREATE_INDEX_SQL:
+        match = re.search(r'\bON (\w+)(?: USING \w+)?\s*\(\s*(\w+)', index_sql)
+        if match:
+            indexed_columns.setdefault(match.group(1), set()).add(match.group(2))
+    
+    statements = []
+    for policy in policies:
+        table = policy['table']
+        if table not in table_columns:
+            raise ValueError(f"RLS policy {policy['name']!r} targets unknown table {table!r}")
+        for column in _policy_columns(policy['sql'], table_columns[table]):
+            if column not in indexed_columns[table]:
+                statements.append(
+                    f"CREATE INDEX IF NOT EXISTS idx_{table}_{column}_rls ON {table}({column});"
+                )
+                indexed_columns[table].add(column)
+    
+    return tuple(statements)
+
+
+# Flattened, ready-to-run statement tuples for each setup phase
+_CREATE_TABLE_SQL = (
+    *(table['sql'] for table in _TABLES),
+    _PARTITION_MAINTENANCE_SQL,
+    _COMPRESSION_SQL,
+)
+
+_RLS_SQL = (
+    *(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY;" for table in _RLS_TABLES),
+    *_rls_predicate_indexes(),
+    *(policy['sql'] for policy in _RLS_POLICIES),
+)
+
+_FUNCTION_SQL = (_DEVICE_HEALTH_ROLLUP_SQL, *(func['sql'] for func in _FUNCTIONS))
+
+_TRIGGER_SQL = (
+    _TOUCH_AUDIT_COLS_SQL,
+    *(trigger['sql'] for trigger in _TRIGGERS),
+    _DROP_LEGACY_TRIGGER_FUNCTIONS_SQL,
+)
+
+_AUDIT_SQL = (_AUDIT_TABLE_SQL, _AUDIT_RLS_SQL, *_AUDIT_INDEXES, _AUDIT_FUNCTION_SQL)
+
+# Migrations applied over a direct connection are recorded in the same table
+# the Management API uses, so list_migrations sees them on every path. Only
+# internally generated values are interpolated: a timestamp version and a
+# phase name plus hex digest
+_RECORD_MIGRATION_SQL = '''
+CREATE SCHEMA IF NOT EXISTS supabase_migrations;
+CREATE TABLE IF NOT EXISTS supabase_migrations.schema_migrations (
+    version TEXT PRIMARY KEY,
+    statements TEXT[],
+    name TEXT
+);
+INSERT INTO supabase_migrations.schema_migrations (version, name) VALUES ('{version}', '{name}');
+'''
+
+_LIST_MIGRATIONS_SQL = "SELECT name FROM supabase_migrations.schema_migrations WHERE name IS NOT NULL"
+
 
 class SupabaseSetup:
     """
@@ -29,385 +778,497 @@ class SupabaseSetup:
     - Performance optimization
     """
     
-    def __init__(self, project_ref: str, access_token: str):
+    # With gzip_requests enabled, request bodies at least this large are
+    # sent gzip-compressed
+    GZIP_MIN_BYTES = 1024
+    # Seconds to wait for an API response (connection.timeout in supabase_config.json)
+    REQUEST_TIMEOUT = 30
+    # Seconds a psql run may take; DDL can wait on locks or build indexes
+    PSQL_TIMEOUT = 600
+    
+    # Static part of the schema documentation; created_at is stamped on
+    # each time the artifact is written
+    _SCHEMA_DOC: Dict[str, Any] = {
+        "database_name": "autonomous_physical_therapy_device",
+        "version": "1.0.0",
+        "compliance": ["IEC 62304 Class C", "HIPAA", "GDPR"],
+        "tables": {
+            "patients": {
+                "purpose": "HIPAA-compliant patient information storage",
+                "primary_key": "id (UUID)",
+                "foreign_keys": [],
+                "indexes": ["patient_identifier", "contact_info (GIN)"],
+                "rls_enabled": True,
+                "audit_enabled": True
+            },
+            "treatment_sessions": {
+                "purpose": "Physical therapy session records",
+                "primary_key": "id (UUID)",
+                "foreign_keys": ["patient_id -> patients(id)"],
+                "indexes": ["patient_id", "session_date", "device_id"],
+                "rls_enabled": True,
+                "audit_enabled": True
+            },
+            "exercise_data": {
+                "purpose": "Individual exercise performance data",
+                "primary_key": "id (UUID), timestamp",
+                "foreign_keys": ["session_id -> treatment_sessions(id)"],
+                "indexes": ["session_id", "exercise_type", "timestamp"],
+                "partitioning": "RANGE (timestamp), monthly",
+                "rls_enabled": True,
+                "audit_enabled": True
+            },
+            "device_logs": {
+                "purpose": "Device operation and error logs",
+                "primary_key": "id (UUID), timestamp",
+                "foreign_keys": ["session_id -> treatment_sessions(id)"],
+                "indexes": ["device_id, timestamp", "timestamp", "metadata (GIN)"],
+                "partitioning": "RANGE (timestamp), monthly",
+                "rls_enabled": True,
+                "audit_enabled": False
+            },
+            "performance_metrics": {
+                "purpose": "Patient performance metrics and progress tracking",
+                "primary_key": "id (UUID)",
+                "foreign_keys": ["session_id -> treatment_sessions(id)"],
+                "indexes": ["session_id", "metric_type"],
+                "rls_enabled": True,
+                "audit_enabled": True
+            },
+            "ai_models": {
+                "purpose": "AI model versions and metadata",
+                "primary_key": "id (UUID)",
+                "foreign_keys": [],
+                "indexes": ["model_name", "model_version"],
+                "rls_enabled": True,
+                "audit_enabled": True
+            },
+            "audit_trail": {
+                "purpose": "Audit trail for compliance",
+                "primary_key": "id (UUID)",
+                "foreign_keys": [],
+                "indexes": ["table_name", "record_id", "timestamp", "user_id", "action"],
+                "rls_enabled": True,
+                "audit_enabled": False
+            }
+        },
+        "functions": [
+            "calculate_session_metrics",
+            "get_patient_progress",
+            "get_device_health"
+        ],
+        "materialized_views": [
+            "device_health_rollup"
+        ],
+        "storage_buckets": [
+            "patient-data",
+            "exercise-videos",
+            "model-files",
+            "reports",
+            "device-logs"
+        ]
+    }
+    
+    # Names the artifact, so it is rewritten only when the document changes
+    _SCHEMA_DOC_SIGNATURE = hashlib.blake2b(
+        json.dumps(_SCHEMA_DOC, sort_keys=True).encode(), digest_size=8
+    ).hexdigest()
+    
+    def __init__(self, project_ref: str, access_token: str, simulation_mode: bool = True,
+                 db_url: Optional[str] = None, gzip_requests: bool = False):
         self.project_ref = project_ref
         self.access_token = access_token
         self.base_url = f"https://{project_ref}.supabase.co"
+        self.management_url = f"https://api.supabase.com/v1/projects/{project_ref}"
         self.api_key = access_token
+        self.simulation_mode = simulation_mode
+        self.applied_migrations: Set[str] = set()
+        self._last_migration_version: Optional[str] = None
+        # When set, setup phases queue their SQL here instead of applying it
+        self._sql_buffer: Optional[List[str]] = None
+        # Created once here so the generators below can write without
+        # checking for the directory first
+        self._docs_dir = _DOCS_DIR
+        self._docs_dir.mkdir(parents=True, exist_ok=True)
         
         self.setup_logging()
-        self.headers = {
+        # Read-only view: the session below is the single owner of the
+        # request headers, so individual calls never pass or copy them
+        self.headers = MappingProxyType({
             'apikey': self.api_key,
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
-        }
+        })
+        
+        # Reuse one keep-alive connection pool for every API call so the
+        # TCP/TLS handshake is paid once per host instead of once per request
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        )
+        self.session.mount('https://', adapter)
+        # The Management API does not document compressed request bodies,
+        # so compression is opt-in
+        self.gzip_requests = gzip_requests
+        
+        # Schema DDL goes straight to Postgres when a connection string is
+        # available; the REST APIs are then only used for storage buckets
+        self.db_url = db_url or os.getenv('SUPABASE_DB_URL')
+        self.db_connection = None
+        self.use_direct_connection = bool(self.db_url) and psycopg is not None
+        # Without psycopg the psql client, when installed, runs the DDL instead
+        self.psql_path = shutil.which('psql') if self.db_url and psycopg is None else None
         
+        if self.db_url and psycopg is None and self.psql_path is None:
+            self.logger.warning("SUPABASE_DB_URL is set but neither psycopg nor psql is installed; using the Management API")
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def close(self):
+        """Release pooled HTTP connections and the direct database connection"""
+        self.session.close()
+        if self.db_connection is not None:
+            self.db_connection.close()
+            # Reopened on demand, so a cached instance stays usable
+            self.db_connection = None
+    
     def setup_logging(self):
         """Configure logging for database setup"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        if not logging.getLogger().handlers:
+            logging.basicConfig(
+                level=logging.INFO,
+                format='%(asctime)s - %(levelname)s - %(message)s'
+            )
         self.logger = logging.getLogger(__name__)
     
+    def get_db_connection(self):
+        """Return the direct Postgres connection, opening it on first use"""
+        if self.db_connection is None:
+            self.db_connection = psycopg.connect(self.db_url)
+        return self.db_connection
+    
     def create_tables(self):
         """Create HIPAA-compliant database tables"""
         self.logger.info("Creating database tables...")
         
-        tables = [
-            {
-                'name': 'patients',
-                'sql': '''
-                CREATE TABLE patients (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    patient_identifier TEXT UNIQUE NOT NULL,
-                    name TEXT NOT NULL,
-                    date_of_birth DATE NOT NULL,
-                    gender TEXT NOT NULL CHECK (gender IN ('male', 'female', 'other')),
-                    contact_info JSONB,
-                    medical_history JSONB,
-                    emergency_contact JSONB,
-                    consent_status BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    created_by UUID,
-                    updated_by UUID
-                );
-                
-                COMMENT ON TABLE patients IS 'Patient information - HIPAA compliant';
-                COMMENT ON COLUMN patients.patient_identifier IS 'Anonymous patient identifier';
-                COMMENT ON COLUMN patients.consent_status IS 'Patient consent for data processing';
-                '''
-            },
-            {
-                'name': 'treatment_sessions',
-                'sql': '''
-                CREATE TABLE treatment_sessions (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    patient_id UUID REFERENCES patients(id) ON DELETE CASCADE,
-                    session_date TIMESTAMP WITH TIME ZONE NOT NULL,
-                    duration INTEGER NOT NULL CHECK (duration > 0),
-                    session_type TEXT NOT NULL,
-                    exercises JSONB NOT NULL,
-                    performance_metrics JSONB,
-                    therapist_notes TEXT,
-                    device_id TEXT NOT NULL,
-                    session_status TEXT DEFAULT 'completed' CHECK (session_status IN ('in_progress', 'completed', 'cancelled')),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    created_by UUID,
-                    updated_by UUID
-                );
-                
-                COMMENT ON TABLE treatment_sessions IS 'Physical therapy treatment sessions';
-                COMMENT ON COLUMN treatment_sessions.duration IS 'Session duration in minutes';
-                COMMENT ON COLUMN treatment_sessions.device_id IS 'Device used for the session';
-                '''
-            },
-            {
-                'name': 'exercise_data',
-                'sql': '''
-                CREATE TABLE exercise_data (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    session_id UUID REFERENCES treatment_sessions(id) ON DELETE CASCADE,
-                    exercise_type TEXT NOT NULL,
-                    exercise_name TEXT NOT NULL,
-                    repetitions INTEGER NOT NULL CHECK (repetitions >= 0),
-                    accuracy_score FLOAT NOT NULL CHECK (accuracy_score >= 0 AND accuracy_score <= 100),
-                    form_analysis JSONB,
-                    movement_data JSONB,
-                    ai_feedback JSONB,
-                    completion_time INTEGER,
-                    difficulty_level INTEGER CHECK (difficulty_level BETWEEN 1 AND 10),
-                    timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-                
-                COMMENT ON TABLE exercise_data IS 'Individual exercise performance data';
-                COMMENT ON COLUMN exercise_data.accuracy_score IS 'Exercise accuracy percentage (0-100)';
-                COMMENT ON COLUMN exercise_data.completion_time IS 'Time to complete exercise in seconds';
-                '''
-            },
-            {
-                'name': 'device_logs',
-                'sql': '''
-                CREATE TABLE device_logs (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    device_id TEXT NOT NULL,
-                    log_type TEXT NOT NULL CHECK (log_type IN ('info', 'warning', 'error', 'critical')),
-                    message TEXT NOT NULL,
-                    severity TEXT NOT NULL CHECK (severity IN ('low', 'medium', 'high', 'critical')),
-                    component TEXT,
-                    error_code TEXT,
-                    metadata JSONB,
-                    session_id UUID REFERENCES treatment_sessions(id),
-                    timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-                
-                COMMENT ON TABLE device_logs IS 'Device operation and error logs';
-                COMMENT ON COLUMN device_logs.component IS 'System component that generated the log';
-                COMMENT ON COLUMN device_logs.error_code IS 'IEC 62304 compliant error code';
-                '''
-            },
-            {
-                'name': 'performance_metrics',
-                'sql': '''
-                CREATE TABLE performance_metrics (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    session_id UUID REFERENCES treatment_sessions(id) ON DELETE CASCADE,
-                    metric_type TEXT NOT NULL,
-                    metric_name TEXT NOT NULL,
-                    value FLOAT NOT NULL,
-                    unit TEXT NOT NULL,
-                    target_value FLOAT,
-                    improvement_percentage FLOAT,
-                    measurement_timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-                
-                COMMENT ON TABLE performance_metrics IS 'Patient performance metrics and progress tracking';
-                COMMENT ON COLUMN performance_metrics.target_value IS 'Target value for this metric';
-                COMMENT ON COLUMN performance_metrics.improvement_percentage IS 'Improvement from baseline';
-                '''
-            },
-            {
-                'name': 'ai_models',
-                'sql': '''
-                CREATE TABLE ai_models (
-                    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                    model_name TEXT UNIQUE NOT NULL,
-                    model_version TEXT NOT NULL,
-                    model_type TEXT NOT NULL CHECK (model_type IN ('pose_estimation', 'movement_analysis', 'quality_assessment')),
-                    accuracy_score FLOAT CHECK (accuracy_score >= 0 AND accuracy_score <= 100),
-                    training_data_info JSONB,
-                    model_parameters JSONB,
-                    validation_results JSONB,
-                    deployment_status TEXT DEFAULT 'development' CHECK (deployment_status IN ('development', 'testing', 'production')),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    created_by UUID
-                );
-                
-                COMMENT ON TABLE ai_models IS 'AI model versions and metadata';
-                COMMENT ON COLUMN ai_models.accuracy_score IS 'Model accuracy percentage';
-                '''
-            }
-        ]
-        
-        for table in tables:
-            self.create_table(table['name'], table['sql'])
+        self.logger.info(f"Creating tables: {', '.join(table['name'] for table in _TABLES)}")
+        applied = self.emit_sql("create_tables", _CREATE_TABLE_SQL)
         
-        self.logger.info("All tables created successfully")
-    
-    def create_table(self, table_name: str, sql: str):
-        """Create a single table with error handling"""
-        try:
-            # For local development, we'll log the SQL instead of executing
-            self.logger.info(f"Creating table: {table_name}")
-            self.logger.debug(f"SQL: {sql}")
-            
-            # In production, uncomment this to execute:
-            # response = requests.post(
-            #     f"{self.base_url}/rest/v1/rpc/exec_sql",
-            #     headers=self.headers,
-            #     json={'sql': sql}
-            # )
-            # 
-            # if response.status_code == 200:
-            #     self.logger.info(f"Table {table_name} created successfully")
-            # else:
-            #     self.logger.error(f"Failed to create table {table_name}: {response.text}")
-                
-        except Exception as e:
-            self.logger.error(f"Error creating table {table_name}: {e}")
+        self._log_phase_result(applied, "tables", "All tables created successfully")
     
     def create_indexes(self):
         """Create performance indexes"""
         self.logger.info("Creating database indexes...")
         
-        indexes = [
-            "CREATE INDEX idx_patients_identifier ON patients(patient_identifier);",
-            "CREATE INDEX idx_patients_name ON patients(name);",
-            "CREATE INDEX idx_treatment_sessions_patient_id ON treatment_sessions(patient_id);",
-            "CREATE INDEX idx_treatment_sessions_date ON treatment_sessions(session_date);",
-            "CREATE INDEX idx_treatment_sessions_device ON treatment_sessions(device_id);",
-            "CREATE INDEX idx_exercise_data_session_id ON exercise_data(session_id);",
-            "CREATE INDEX idx_exercise_data_type ON exercise_data(exercise_type);",
-            "CREATE INDEX idx_exercise_data_timestamp ON exercise_data(timestamp);",
-            "CREATE INDEX idx_device_logs_device_id ON device_logs(device_id);",
-            "CREATE INDEX idx_device_logs_timestamp ON device_logs(timestamp);",
-            "CREATE INDEX idx_device_logs_severity ON device_logs(severity);",
-            "CREATE INDEX idx_performance_metrics_session_id ON performance_metrics(session_id);",
-            "CREATE INDEX idx_performance_metrics_type ON performance_metrics(metric_type);",
-            "CREATE INDEX idx_ai_models_name_version ON ai_models(model_name, model_version);"
-        ]
-        
-        for index_sql in indexes:
-            self.execute_sql(index_sql)
+        applied = self.emit_sql("create_indexes", _CREATE_INDEX_SQL)
         
-        self.logger.info("All indexes created successfully")
+        self._log_phase_result(applied, "indexes", "All indexes created successfully")
     
     def setup_rls(self):
         """Setup Row Level Security (RLS) for HIPAA compliance"""
         self.logger.info("Setting up Row Level Security...")
         
-        # Enable RLS on all tables
-        tables_to_enable_rls = [
-            'patients', 'treatment_sessions', 'exercise_data', 
-            'device_logs', 'performance_metrics', 'ai_models'
-        ]
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for policy in _RLS_POLICIES:
+                self.logger.debug("Creating RLS policy: %s for table: %s", policy['name'], policy['table'])
         
-        for table in tables_to_enable_rls:
-            self.enable_rls(table)
-        
-        # Create RLS policies
-        rls_policies = [
-            {
-                'table': 'patients',
-                'name': 'patients_view_own_data',
-                'sql': '''
-                CREATE POLICY "Patients can view own data" ON patients
-                FOR SELECT USING (auth.uid() = id OR auth.role() IN ('therapist', 'admin'));
-                '''
-            },
-            {
-                'table': 'patients',
-                'name': 'therapists_can_manage_patients',
-                'sql': '''
-                CREATE POLICY "Therapists can manage patient data" ON patients
-                FOR ALL USING (auth.role() IN ('therapist', 'admin'));
-                '''
-            },
-            {
-                'table': 'treatment_sessions',
-                'name': 'sessions_access_control',
-                'sql': '''
-                CREATE POLICY "Session access control" ON treatment_sessions
-                FOR ALL USING (
-                    auth.role() IN ('therapist', 'admin') OR 
-                    patient_id IN (SELECT id FROM patients WHERE auth.uid() = id)
-                );
-                '''
-            },
-            {
-                'table': 'device_logs',
-                'name': 'system_can_manage_logs',
-                'sql': '''
-                CREATE POLICY "System can manage device logs" ON device_logs
-                FOR ALL USING (auth.role() IN ('service_role', 'admin', 'system'));
-                '''
-            },
-            {
-                'table': 'ai_models',
-                'name': 'ai_models_access_control',
-                'sql': '''
-                CREATE POLICY "AI models access control" ON ai_models
-                FOR SELECT USING (deployment_status = 'production' OR auth.role() IN ('developer', 'admin'));
-                '''
-            }
-        ]
+        applied = self.emit_sql("setup_rls", _RLS_SQL)
+        
+        self._log_phase_result(applied, "Row Level Security", "Row Level Security configured successfully")
+    
+    def post_json(self, url: str, payload: Dict[str, Any]) -> requests.Response:
+        """POST a JSON payload, gzip-compressing large bodies when enabled"""
+        body = json.dumps(payload).encode()
         
-        for policy in rls_policies:
-            self.create_rls_policy(policy['table'], policy['name'], policy['sql'])
+        if self.gzip_requests and len(body) >= self.GZIP_MIN_BYTES:
+            response = self.session.post(
+                url,
+                data=gzip.compress(body),
+                headers={'Content-Encoding': 'gzip'},
+                timeout=self.REQUEST_TIMEOUT
+            )
+            if not self._rejects_compression(response):
+                return response
+            
+            # The endpoint does not decode compressed bodies; fall back to
+            # plain JSON for the rest of this session
+            self.logger.warning("Compressed request rejected, resending uncompressed")
+            self.gzip_requests = False
         
-        self.logger.info("Row Level Security configured successfully")
+        return self.session.post(url, data=body, timeout=self.REQUEST_TIMEOUT)
     
-    def enable_rls(self, table_name: str):
-        """Enable RLS for a specific table"""
-        sql = f"ALTER TABLE {table_name} ENABLE ROW LEVEL SECURITY;"
-        self.execute_sql(sql)
-        self.logger.info(f"RLS enabled for table: {table_name}")
+    @staticmethod
+    def _rejects_compression(response: requests.Response) -> bool:
+        """Whether a response refuses the request's Content-Encoding"""
+        # A plain 400 is also how the Management API reports SQL errors, so
+        # it only counts when the body names the encoding
+        if response.status_code == 415:
+            return True
+        body = response.text.lower()
+        return response.status_code == 400 and ('content-encoding' in body or 'gzip' in body)
     
-    def create_rls_policy(self, table_name: str, policy_name: str, sql: str):
-        """Create RLS policy with error handling"""
+    def list_migrations(self) -> Set[str]:
+        """Return the names of migrations already applied to the project"""
+        if self.simulation_mode:
+            return set()
+        
         try:
-            self.logger.info(f"Creating RLS policy: {policy_name} for table: {table_name}")
-            self.logger.debug(f"Policy SQL: {sql}")
+            if self.use_direct_connection:
+                connection = self.get_db_connection()
+                # A failed read must not leave the connection in an aborted transaction
+                with connection.transaction():
+                    return {row[0] for row in connection.execute(_LIST_MIGRATIONS_SQL)}
+            
+            if self.psql_path:
+                output = self._run_psql('--no-align', '--tuples-only', '-c', _LIST_MIGRATIONS_SQL)
+                return set(output.split())
+            
+            response = self.session.get(
+                f"{self.management_url}/database/migrations",
+                timeout=self.REQUEST_TIMEOUT
+            )
+            
+            if response.status_code != 200:
+                self.logger.error(f"Failed to list migrations: {response.text}")
+                return set()
             
-            # In production, uncomment this to execute:
-            # response = requests.post(
-            #     f"{self.base_url}/rest/v1/rpc/exec_sql",
-            #     headers=self.headers,
-            #     json={'sql': sql}
-            # )
-            # 
-            # if response.status_code == 200:
-            #     self.logger.info(f"RLS policy {policy_name} created successfully")
-            # else:
-            #     self.logger.error(f"Failed to create RLS policy {policy_name}: {response.text}")
+            return {migration['name'] for migration in response.json() if migration.get('name')}
                 
         except Exception as e:
-            self.logger.error(f"Error creating RLS policy {policy_name}: {e}")
+            self.logger.error(f"Error listing migrations: {e}")
+            return set()
+    
+    def _log_phase_result(self, applied: bool, subject: str, message: str):
+        """Log a phase's success only once its SQL has actually been applied"""
+        if self._sql_buffer is not None:
+            self.logger.info("Queued %s for the schema migration", subject)
+        elif applied:
+            self.logger.info(message)
+    
+    def emit_sql(self, phase: str, statements: Sequence[str]) -> bool:
+        """Queue a phase's SQL while buffering, otherwise apply it right away"""
+        if self._sql_buffer is not None:
+            self._sql_buffer.extend(statements)
+            return True
+        
+        return self.apply_migration(phase, statements)
     
-    def execute_sql(self, sql: str):
-        """Execute SQL command with error handling"""
+    def apply_migration(self, phase: str, statements: Sequence[str]) -> bool:
+        """
+        Apply setup SQL as a named, version-tracked migration
+        
+        The statements are joined into one script and sent in a single
+        round-trip, either over the direct Postgres connection (psycopg, or
+        psql when psycopg is missing) or as one Management API call. Every
+        path records the migration in supabase_migrations.schema_migrations;
+        the direct paths do so in the same transaction as the script. The
+        migration name embeds a hash of the script, so it is skipped when
+        that exact script has already been applied and re-applied (the DDL
+        is idempotent) whenever its SQL changes.
+        """
+        sql = "\n".join(statement.strip() for statement in statements)
+        name = f"{phase}_{hashlib.sha256(sql.encode()).hexdigest()[:12]}"
+        
+        if name in self.applied_migrations:
+            self.logger.info(f"Skipping migration {name}: already applied")
+            return True
+        
         try:
-            self.logger.debug(f"Executing SQL: {sql}")
+            self.logger.info(f"Applying migration {name} ({len(statements)} statements)")
+            self.logger.debug("Migration SQL: %s", sql)
+            
+            if self.simulation_mode:
+                return True
+            
+            if self.use_direct_connection or self.psql_path:
+                sql += _RECORD_MIGRATION_SQL.format(version=self._next_migration_version(), name=name)
+            
+            if self.use_direct_connection:
+                connection = self.get_db_connection()
+                with connection.transaction():
+                    # Without parameters the whole script is sent as a single
+                    # simple-query message. Pipeline mode would not save
+                    # anything here: it goes through the extended protocol,
+                    # which accepts one statement per execute, and several
+                    # entries (tables with comments, PL/pgSQL bodies) are
+                    # multi-statement scripts
+                    connection.execute(sql)
+                self.applied_migrations.add(name)
+                return True
+            
+            if self.psql_path:
+                self._apply_via_psql(sql)
+                self.applied_migrations.add(name)
+                return True
+            
+            response = self.post_json(
+                f"{self.management_url}/database/migrations",
+                {'name': name, 'query': sql}
+            )
             
-            # In production, uncomment this to execute:
-            # response = requests.post(
-            #     f"{self.base_url}/rest/v1/rpc/exec_sql",
-            #     headers=self.headers,
-            #     json={'sql': sql}
-            # )
-            # 
-            # if response.status_code != 200:
-            #     self.logger.error(f"SQL execution failed: {response.text}")
+            if not response.ok:
+                self.logger.error(f"Migration {name} failed: {response.text}")
+                return False
+            
+            self.applied_migrations.add(name)
+            return True
                 
         except Exception as e:
-            self.logger.error(f"SQL execution error: {e}")
+            self.logger.error(f"Migration {name} error: {e}")
+            return False
+    
+    def _next_migration_version(self) -> str:
+        """Timestamp version in the Management API's format, unique within this run"""
+        version = datetime.now().strftime('%Y%m%d%H%M%S')
+        if self._last_migration_version is not None and version <= self._last_migration_version:
+            version = str(int(self._last_migration_version) + 1)
+        self._last_migration_version = version
+        return version
+    
+    def _psql_connection(self) -> Tuple[str, Dict[str, str]]:
+        """
+        Split db_url into a password-free connection string and environment
+        
+        The command line of a running psql is visible to every local user,
+        so the password is handed over in PGPASSWORD instead.
+        """
+        env = dict(os.environ)
+        
+        if '://' not in self.db_url:
+            # key=value connection string
+            match = re.search(r"\bpassword\s*=\s*(?:'((?:[^'\\]|\\.)*)'|(\S+))", self.db_url)
+            if match is None:
+                return self.db_url, env
+            env['PGPASSWORD'] = re.sub(r"\\(.)", r"\1", match.group(1)) if match.group(1) is not None else match.group(2)
+            return (self.db_url[:match.start()] + self.db_url[match.end():]).strip(), env
+        
+        url = urlsplit(self.db_url)
+        params = [param.partition('=') for param in url.query.split('&') if param]
+        query_passwords = [value for key, _, value in params if key == 'password']
+        if url.password is None and not query_passwords:
+            return self.db_url, env
+        
+        # As in libpq, a ?password= parameter overrides the userinfo one
+        env['PGPASSWORD'] = unquote(query_passwords[-1] if query_passwords else url.password)
+        netloc = url.netloc
+        if url.password is not None:
+            userinfo, host = url.netloc.rsplit('@', 1)
+            netloc = f"{userinfo.split(':', 1)[0]}@{host}"
+        query = '&'.join(''.join(param) for param in params if param[0] != 'password')
+        return urlunsplit(url._replace(netloc=netloc, query=query)), env
+    
+    def _run_psql(self, *args: str, input: str = '') -> str:
+        """Run psql against the database, returning stdout or raising on failure"""
+        dsn, env = self._psql_connection()
+        # stdin is always a pipe and password prompts are disabled, so psql
+        # can never block waiting on the terminal
+        result = subprocess.run(
+            [self.psql_path, '--no-psqlrc', '--no-password', '--quiet', '-v', 'ON_ERROR_STOP=1',
+             '-d', dsn, *args],
+            input=input,
+            capture_output=True,
+            text=True,
+            env=env,
+            timeout=self.PSQL_TIMEOUT
+        )
+        
+        if result.returncode != 0:
+            raise RuntimeError(f"psql exited with status {result.returncode}: {result.stderr.strip()}")
+        return result.stdout
+    
+    def _apply_via_psql(self, sql: str):
+        """Run a SQL script through psql as one transaction, stopping at the first error"""
+        # The script is piped on stdin, so schema SQL is never spilled to disk
+        self._run_psql('--single-transaction', '-f', '-', input=sql)
+    
+    def bulk_load(self, table: str, columns: List[str], rows: Iterable[Sequence[Any]]) -> int:
+        """
+        Stream rows into a table with COPY FROM STDIN
+        
+        Use this for any fixture or seed data instead of building
+        INSERT ... VALUES strings. COPY FROM is refused on tables with
+        row-level security for roles the policies apply to (any role but the
+        table owner or one with BYPASSRLS); those loads fall back to a
+        parameterized INSERT per row. Returns the number of rows.
+        """
+        if self.simulation_mode:
+            row_count = sum(1 for _ in rows)
+            self.logger.info(f"Simulated bulk load of {row_count} rows into {table}")
+            return row_count
+        
+        if not self.use_direct_connection:
+            raise RuntimeError("Bulk loading requires SUPABASE_DB_URL and psycopg")
+        
+        connection = self.get_db_connection()
+        table_id = pg_sql.Identifier(table)
+        column_ids = pg_sql.SQL(', ').join(map(pg_sql.Identifier, columns))
+        row_count = 0
+        
+        try:
+            with connection.transaction(), connection.cursor() as cursor:
+                copy_sql = pg_sql.SQL("COPY {} ({}) FROM STDIN").format(table_id, column_ids)
+                with cursor.copy(copy_sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                        row_count += 1
+        except psycopg.errors.FeatureNotSupported:
+            # "COPY FROM not supported with row-level security" is raised
+            # before any row is consumed, so nothing is lost; INSERT goes
+            # through the table's policies instead
+            if row_count:
+                raise
+            self.logger.warning(f"COPY not supported on {table}, falling back to INSERT")
+            insert_sql = pg_sql.SQL("INSERT INTO {} ({}) VALUES ({})").format(
+                table_id, column_ids, pg_sql.SQL(', ').join([pg_sql.Placeholder()] * len(columns))
+            )
+            rows = list(rows)
+            # executemany sends one single-row INSERT per row; psycopg
+            # pipelines them, so this is not a round-trip per row
+            with connection.transaction(), connection.cursor() as cursor:
+                cursor.executemany(insert_sql, rows)
+            row_count = len(rows)
+        
+        self.logger.info(f"Loaded {row_count} rows into {table}")
+        return row_count
     
     def create_storage_buckets(self):
         """Create storage buckets for medical data"""
         self.logger.info("Creating storage buckets...")
         
-        buckets = [
-            {
-                'name': 'patient-data',
-                'public': False,
-                'description': 'HIPAA-compliant patient data storage'
-            },
-            {
-                'name': 'exercise-videos',
-                'public': False,
-                'description': 'Exercise demonstration videos'
-            },
-            {
-                'name': 'model-files',
-                'public': False,
-                'description': 'AI model files and weights'
-            },
-            {
-                'name': 'reports',
-                'public': False,
-                'description': 'Patient progress reports'
-            },
-            {
-                'name': 'device-logs',
-                'public': False,
-                'description': 'Device operation logs'
-            }
-        ]
-        
-        for bucket in buckets:
-            self.create_storage_bucket(bucket['name'], bucket['public'])
+        # Bucket creations are independent, so overlap their round-trips
+        with ThreadPoolExecutor(max_workers=len(_BUCKETS)) as executor:
+            list(executor.map(
+                lambda bucket: self.create_storage_bucket(bucket['name'], bucket['public']),
+                _BUCKETS
+            ))
         
-        self.logger.info("Storage buckets created successfully")
+        self.logger.info("Storage buckets created successfully (%d buckets)", len(_BUCKETS))
     
     def create_storage_bucket(self, bucket_name: str, public: bool):
         """Create storage bucket with error handling"""
         try:
-            self.logger.info(f"Creating storage bucket: {bucket_name}")
+            self.logger.debug("Creating storage bucket: %s", bucket_name)
+            
+            if self.simulation_mode:
+                return
+            
+            response = self.session.post(
+                f"{self.base_url}/storage/v1/bucket",
+                json={'name': bucket_name, 'public': public},
+                timeout=self.REQUEST_TIMEOUT
+            )
             
-            # In production, uncomment this to execute:
-            # response = requests.post(
-            #     f"{self.base_url}/storage/v1/bucket",
-            #     headers=self.headers,
-            #     json={'name': bucket_name, 'public': public}
-            # )
-            # 
-            # if response.status_code == 200:
-            #     self.logger.info(f"Storage bucket {bucket_name} created successfully")
-            # else:
-            #     self.logger.error(f"Failed to create storage bucket {bucket_name}: {response.text}")
+            if response.status_code == 200:
+                self.logger.debug("Storage bucket %s created successfully", bucket_name)
+            else:
+                self.logger.error(f"Failed to create storage bucket {bucket_name}: {response.text}")
                 
         except Exception as e:
             self.logger.error(f"Error creating storage bucket {bucket_name}: {e}")
@@ -416,330 +1277,72 @@ class SupabaseSetup:
         """Create database functions for analytics and reporting"""
         self.logger.info("Creating database functions...")
         
-        functions = [
-            {
-                'name': 'calculate_session_metrics',
-                'sql': '''
-                CREATE OR REPLACE FUNCTION calculate_session_metrics(session_id UUID)
-                RETURNS TABLE(metric_type TEXT, metric_name TEXT, value FLOAT, unit TEXT) AS $$
-                BEGIN
-                    RETURN QUERY
-                    SELECT 
-                        pm.metric_type,
-                        pm.metric_name,
-                        pm.value,
-                        pm.unit
-                    FROM performance_metrics pm
-                    WHERE pm.session_id = calculate_session_metrics.session_id
-                    ORDER BY pm.created_at;
-                END;
-                $$ LANGUAGE plpgsql SECURITY DEFINER;
-                
-                COMMENT ON FUNCTION calculate_session_metrics IS 'Calculate performance metrics for a session';
-                '''
-            },
-            {
-                'name': 'get_patient_progress',
-                'sql': '''
-                CREATE OR REPLACE FUNCTION get_patient_progress(patient_id UUID, days_back INTEGER DEFAULT 30)
-                RETURNS TABLE(session_date DATE, average_accuracy FLOAT, total_exercises INTEGER, session_duration INTEGER) AS $$
-                BEGIN
-                    RETURN QUERY
-                    SELECT 
-                        ts.session_date::DATE,
-                        ROUND(AVG(ed.accuracy_score)::numeric, 2)::FLOAT as average_accuracy,
-                        COUNT(ed.id)::INTEGER as total_exercises,
-                        ts.duration
-                    FROM treatment_sessions ts
-                    JOIN exercise_data ed ON ts.id = ed.session_id
-                    WHERE ts.patient_id = get_patient_progress.patient_id
-                        AND ts.session_date >= (CURRENT_DATE - INTERVAL '1 day' * days_back)
-                    GROUP BY ts.session_date::DATE, ts.duration
-                    ORDER BY ts.session_date::DATE;
-                END;
-                $$ LANGUAGE plpgsql SECURITY DEFINER;
-                
-                COMMENT ON FUNCTION get_patient_progress IS 'Get patient progress over specified time period';
-                '''
-            },
-            {
-                'name': 'get_device_health',
-                'sql': '''
-                CREATE OR REPLACE FUNCTION get_device_health(device_id TEXT, hours_back INTEGER DEFAULT 24)
-                RETURNS TABLE(
-                    total_logs INTEGER,
-                    error_count INTEGER,
-                    warning_count INTEGER,
-                    critical_count INTEGER,
-                    health_score FLOAT
-                ) AS $$
-                DECLARE
-                    total_logs_count INTEGER;
-                    error_count_val INTEGER;
-                    warning_count_val INTEGER;
-                    critical_count_val INTEGER;
-                    health_score_val FLOAT;
-                BEGIN
-                    SELECT 
-                        COUNT(*),
-                        COUNT(*) FILTER (WHERE log_type = 'error'),
-                        COUNT(*) FILTER (WHERE log_type = 'warning'),
-                        COUNT(*) FILTER (WHERE log_type = 'critical')
-                    INTO total_logs_count, error_count_val, warning_count_val, critical_count_val
-                    FROM device_logs dl
-                    WHERE dl.device_id = get_device_health.device_id
-                        AND dl.timestamp >= (NOW() - INTERVAL '1 hour' * hours_back);
-                    
-                    -- Calculate health score (0-100)
-                    health_score_val := CASE 
-                        WHEN total_logs_count = 0 THEN 100
-                        ELSE GREATEST(0, 100 - (critical_count_val * 30) - (error_count_val * 10) - (warning_count_val * 2))
-                    END;
-                    
-                    RETURN QUERY SELECT 
-                        total_logs_count,
-                        error_count_val,
-                        warning_count_val,
-                        critical_count_val,
-                        health_score_val;
-                END;
-                $$ LANGUAGE plpgsql SECURITY DEFINER;
-                
-                COMMENT ON FUNCTION get_device_health IS 'Calculate device health score based on logs';
-                '''
-            }
-        ]
-        
-        for func in functions:
-            self.create_function(func['name'], func['sql'])
+        self.logger.info(f"Creating functions: {', '.join(func['name'] for func in _FUNCTIONS)}")
+        applied = self.emit_sql("setup_database_functions", _FUNCTION_SQL)
         
-        self.logger.info("Database functions created successfully")
-    
-    def create_function(self, func_name: str, sql: str):
-        """Create database function with error handling"""
-        try:
-            self.logger.info(f"Creating function: {func_name}")
-            self.logger.debug(f"Function SQL: {sql}")
-            
-            # In production, uncomment this to execute:
-            # response = requests.post(
-            #     f"{self.base_url}/rest/v1/rpc/exec_sql",
-            #     headers=self.headers,
-            #     json={'sql': sql}
-            # )
-            # 
-            # if response.status_code == 200:
-            #     self.logger.info(f"Function {func_name} created successfully")
-            # else:
-            #     self.logger.error(f"Failed to create function {func_name}: {response.text}")
-                
-        except Exception as e:
-            self.logger.error(f"Error creating function {func_name}: {e}")
+        self._log_phase_result(applied, "database functions", "Database functions created successfully")
     
     def create_triggers(self):
         """Create database triggers for audit trail"""
         self.logger.info("Creating database triggers...")
         
-        triggers = [
-            {
-                'name': 'update_patient_timestamp',
-                'table': 'patients',
-                'sql': '''
-                CREATE OR REPLACE FUNCTION update_patient_timestamp()
-                RETURNS TRIGGER AS $$
-                BEGIN
-                    NEW.updated_at = NOW();
-                    NEW.updated_by = auth.uid();
-                    RETURN NEW;
-                END;
-                $$ LANGUAGE plpgsql SECURITY DEFINER;
-                
-                DROP TRIGGER IF EXISTS update_patient_timestamp ON patients;
-                CREATE TRIGGER update_patient_timestamp
-                    BEFORE UPDATE ON patients
-                    FOR EACH ROW EXECUTE FUNCTION update_patient_timestamp();
-                '''
-            },
-            {
-                'name': 'update_session_timestamp',
-                'table': 'treatment_sessions',
-                'sql': '''
-                CREATE OR REPLACE FUNCTION update_session_timestamp()
-                RETURNS TRIGGER AS $$
-                BEGIN
-                    NEW.updated_at = NOW();
-                    NEW.updated_by = auth.uid();
-                    RETURN NEW;
-                END;
-                $$ LANGUAGE plpgsql SECURITY DEFINER;
-                
-                DROP TRIGGER IF EXISTS update_session_timestamp ON treatment_sessions;
-                CREATE TRIGGER update_session_timestamp
-                    BEFORE UPDATE ON treatment_sessions
-                    FOR EACH ROW EXECUTE FUNCTION update_session_timestamp();
-                '''
-            }
-        ]
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for trigger in _TRIGGERS:
+                self.logger.debug("Creating trigger: %s for table: %s", trigger['name'], trigger['table'])
         
-        for trigger in triggers:
-            self.create_trigger(trigger['name'], trigger['table'], trigger['sql'])
+        applied = self.emit_sql("create_triggers", _TRIGGER_SQL)
         
-        self.logger.info("Database triggers created successfully")
-    
-    def create_trigger(self, trigger_name: str, table_name: str, sql: str):
-        """Create database trigger with error handling"""
-        try:
-            self.logger.info(f"Creating trigger: {trigger_name} for table: {table_name}")
-            self.logger.debug(f"Trigger SQL: {sql}")
-            
-            # In production, uncomment this to execute:
-            # response = requests.post(
-            #     f"{self.base_url}/rest/v1/rpc/exec_sql",
-            #     headers=self.headers,
-            #     json={'sql': sql}
-            # )
-            # 
-            # if response.status_code == 200:
-            #     self.logger.info(f"Trigger {trigger_name} created successfully")
-            # else:
-            #     self.logger.error(f"Failed to create trigger {trigger_name}: {response.text}")
-                
-        except Exception as e:
-            self.logger.error(f"Error creating trigger {trigger_name}: {e}")
+        self._log_phase_result(applied, "database triggers", "Database triggers created successfully")
     
     def setup_audit_trail(self):
         """Setup audit trail system for compliance"""
         self.logger.info("Setting up audit trail system...")
         
-        # Create audit table
-        audit_table_sql = '''
-        CREATE TABLE IF NOT EXISTS audit_trail (
-            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-            table_name TEXT NOT NULL,
-            record_id UUID NOT NULL,
-            action TEXT NOT NULL CHECK (action IN ('INSERT', 'UPDATE', 'DELETE')),
-            old_data JSONB,
-            new_data JSONB,
-            user_id UUID,
-            user_role TEXT,
-            ip_address INET,
-            user_agent TEXT,
-            timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-        );
-        
-        COMMENT ON TABLE audit_trail IS 'Audit trail for all database changes - IEC 62304 compliance';
-        '''
+        applied = self.emit_sql("setup_audit_trail", _AUDIT_SQL)
         
-        self.execute_sql(audit_table_sql)
-        
-        # Create audit indexes
-        audit_indexes = [
-            "CREATE INDEX IF NOT EXISTS idx_audit_table_name ON audit_trail(table_name);",
-            "CREATE INDEX IF NOT EXISTS idx_audit_record_id ON audit_trail(record_id);",
-            "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_trail(timestamp);",
-            "CREATE INDEX IF NOT EXISTS idx_audit_user_id ON audit_trail(user_id);",
-            "CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_trail(action);"
-        ]
-        
-        for index_sql in audit_indexes:
-            self.execute_sql(index_sql)
-        
-        self.logger.info("Audit trail system configured successfully")
+        self._log_phase_result(applied, "audit trail system", "Audit trail system configured successfully")
     
     def create_database_schema_documentation(self):
         """Generate database schema documentation"""
         self.logger.info("Generating database schema documentation...")
         
-        schema_doc = {
-            "database_name": "autonomous_physical_therapy_device",
-            "version": "1.0.0",
-            "compliance": ["IEC 62304 Class C", "HIPAA", "GDPR"],
-            "created_at": datetime.now().isoformat(),
-            "tables": {
-                "patients": {
-                    "purpose": "HIPAA-compliant patient information storage",
-                    "primary_key": "id (UUID)",
-                    "foreign_keys": [],
-                    "indexes": ["patient_identifier", "name"],
-                    "rls_enabled": True,
-                    "audit_enabled": True
-                },
-                "treatment_sessions": {
-                    "purpose": "Physical therapy session records",
-                    "primary_key": "id (UUID)",
-                    "foreign_keys": ["patient_id -> patients(id)"],
-                    "indexes": ["patient_id", "session_date", "device_id"],
-                    "rls_enabled": True,
-                    "audit_enabled": True
-                },
-                "exercise_data": {
-                    "purpose": "Individual exercise performance data",
-                    "primary_key": "id (UUID)",
-                    "foreign_keys": ["session_id -> treatment_sessions(id)"],
-                    "indexes": ["session_id", "exercise_type", "timestamp"],
-                    "rls_enabled": True,
-                    "audit_enabled": True
-                },
-                "device_logs": {
-                    "purpose": "Device operation and error logs",
-                    "primary_key": "id (UUID)",
-                    "foreign_keys": ["session_id -> treatment_sessions(id)"],
-                    "indexes": ["device_id", "timestamp", "severity"],
-                    "rls_enabled": True,
-                    "audit_enabled": False
-                },
-                "performance_metrics": {
-                    "purpose": "Patient performance metrics and progress tracking",
-                    "primary_key": "id (UUID)",
-                    "foreign_keys": ["session_id -> treatment_sessions(id)"],
-                    "indexes": ["session_id", "metric_type"],
-                    "rls_enabled": True,
-                    "audit_enabled": True
-                },
-                "ai_models": {
-                    "purpose": "AI model versions and metadata",
-                    "primary_key": "id (UUID)",
-                    "foreign_keys": [],
-                    "indexes": ["model_name", "model_version"],
-                    "rls_enabled": True,
-                    "audit_enabled": True
-                },
-                "audit_trail": {
-                    "purpose": "Audit trail for compliance",
-                    "primary_key": "id (UUID)",
-                    "foreign_keys": [],
-                    "indexes": ["table_name", "record_id", "timestamp", "user_id", "action"],
-                    "rls_enabled": True,
-                    "audit_enabled": False
-                }
-            },
-            "functions": [
-                "calculate_session_metrics",
-                "get_patient_progress",
-                "get_device_health"
-            ],
-            "storage_buckets": [
-                "patient-data",
-                "exercise-videos",
-                "model-files",
-                "reports",
-                "device-logs"
-            ]
-        }
-        
-        # Save schema documentation
-        docs_path = Path("docs/database")
-        docs_path.mkdir(exist_ok=True)
-        
-        with open(docs_path / "schema_documentation.json", 'w') as f:
-            json.dump(schema_doc, f, indent=2)
+        # The document is written once per version of its content to
+        # schema_documentation.<signature>.json, and schema_documentation.json
+        # links to the current one
+        artifact_path = self._docs_dir / f"schema_documentation.{self._SCHEMA_DOC_SIGNATURE}.json"
+        link_path = self._docs_dir / "schema_documentation.json"
+        
+        try:
+            if link_path.is_symlink():
+                up_to_date = link_path.resolve(strict=True) == artifact_path.resolve()
+            else:
+                # The plain-copy fallback matches the artifact byte for byte
+                up_to_date = link_path.read_bytes() == artifact_path.read_bytes()
+        except FileNotFoundError:
+            up_to_date = False
+        if up_to_date:
+            self.logger.info("Database schema documentation is up to date")
+            return
+        
+        for stale_path in self._docs_dir.glob("schema_documentation.*.json"):
+            stale_path.unlink()
+        
+        artifact_path.write_bytes(_dump_json({**self._SCHEMA_DOC, "created_at": datetime.now().isoformat()}))
+        
+        link_path.unlink(missing_ok=True)
+        try:
+            link_path.symlink_to(artifact_path.name)
+        except OSError:
+            # Filesystems without symlink support get a plain copy
+            shutil.copyfile(artifact_path, link_path)
         
         self.logger.info("Database schema documentation generated")
     
-    def complete_setup(self):
-        """Execute complete database setup"""
-        self.logger.info("Starting complete Supabase database setup...")
-        
+    def apply_schema(self):
+        """Apply every DDL phase together as one migration"""
+        # Collect the phases in order, then apply them in a single
+        # round-trip that succeeds or fails as a whole
+        self._sql_buffer = []
         try:
             # Create database structure
             self.create_tables()
@@ -748,9 +1351,6 @@ class SupabaseSetup:
             # Setup security
             self.setup_rls()
             
-            # Create storage
-            self.create_storage_buckets()
-            
             # Create functions and triggers
             self.setup_database_functions()
             self.create_triggers()
@@ -758,8 +1358,37 @@ class SupabaseSetup:
             # Setup audit trail
             self.setup_audit_trail()
             
-            # Generate documentation
-            self.create_database_schema_documentation()
+            schema_statements = self._sql_buffer
+        finally:
+            self._sql_buffer = None
+        
+        self.logger.info("Emitted %d DDL scripts", len(schema_statements))
+        if not self.apply_migration("schema_setup", schema_statements):
+            raise RuntimeError("Schema migration was not applied")
+        
+        self.logger.info("Schema migration applied: tables, indexes, RLS, functions, triggers and audit trail are in place")
+    
+    def complete_setup(self):
+        """Execute complete database setup"""
+        self.logger.info("Starting complete Supabase database setup...")
+        
+        try:
+            # A schema whose exact SQL was applied on a previous run is skipped
+            self.applied_migrations = self.list_migrations()
+            
+            # Schema, storage and documentation do not depend on each other;
+            # the ordering between DDL phases is kept inside the migration
+            setup_tasks = {
+                self.apply_schema: "schema",
+                self.create_storage_buckets: "storage buckets",
+                self.create_database_schema_documentation: "documentation",
+            }
+            
+            with ThreadPoolExecutor(max_workers=len(setup_tasks)) as executor:
+                futures = {executor.submit(task): name for task, name in setup_tasks.items()}
+                for future in as_completed(futures):
+                    future.result()
+                    self.logger.info(f"Finished setup task: {futures[future]}")
             
             self.logger.info("✅ Supabase database setup completed successfully!")
             self.logger.info("Database is ready for medical device deployment")
@@ -769,19 +1398,27 @@ class SupabaseSetup:
             raise
 
 
+@functools.lru_cache(maxsize=4)
+def get_setup(project_ref: str, access_token: str, simulation_mode: bool = True) -> SupabaseSetup:
+    """Return a shared SupabaseSetup (and its connection pool) per project"""
+    return SupabaseSetup(project_ref, access_token, simulation_mode=simulation_mode)
+
+
 def main():
     """Main function to run database setup"""
     # Configuration (replace with your actual Supabase credentials)
     project_ref = os.getenv('SUPABASE_PROJECT_REF', 'your-project-ref')
     access_token = os.getenv('SUPABASE_ACCESS_TOKEN', 'your-access-token')
     
-    if project_ref == 'your-project-ref' or access_token == 'your-access-token':
+    simulation_mode = project_ref == 'your-project-ref' or access_token == 'your-access-token'
+    
+    if simulation_mode:
         print("⚠️  Please set SUPABASE_PROJECT_REF and SUPABASE_ACCESS_TOKEN environment variables")
         print("For development, the script will run in simulation mode")
     
     # Initialize and run setup
-    setup = SupabaseSetup(project_ref, access_token)
-    setup.complete_setup()
+    with get_setup(project_ref, access_token, simulation_mode=simulation_mode) as setup:
+        setup.complete_setup()
 
 
 if __name__ == "__main__":